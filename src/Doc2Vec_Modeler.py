@@ -2,21 +2,80 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import re
+import os
+import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import gensim
+from numba import njit, prange, set_num_threads
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.linear_model import LogisticRegression, LinearRegression
-from scipy.spatial.distance import cosine, euclidean
 from scipy.stats import ttest_ind
 
 from prepare_data import save_in_pkl, read_in_pkl
 
+EPS = np.float32(1e-8) # keeps cosine similarity finite for zero vectors (docs with no in-vocab tokens)
+SIM_BLOCK_SIZE = 256 # rows/cols per tile of the self-recognition similarity matrix
+THREADS_PER_MODEL = 3 # gensim's default number of Doc2Vec training workers
+
+_pairings = dict() # train/test pairings DataFrames, shared by every model trained in this process
+_corpora = dict() # training corpora by name, sent once to each worker process
+_worker_settings = {'n_threads': os.cpu_count()} # threads each model in this process may use for inference
+
+@njit(parallel=True, fastmath=True, cache=True)
+def pair_stats(R, T):
+    '''Calculates cosine similarity and euclidean distance between each row-aligned pair of DocVecs in a single fused pass
+    INPUT: (N, D) float32 array of lyric DocVecs, (N, D) float32 array of annotation DocVecs
+    OUTPUT: array of N cosine similarities, array of N euclidean distances
+    '''
+    N, D = R.shape
+    rt_cs = np.empty(N, dtype=np.float32)
+    rt_ed = np.empty(N, dtype=np.float32)
+    for i in prange(N):
+        dot = np.float32(0.0)
+        nr = np.float32(0.0)
+        nt = np.float32(0.0)
+        for d in range(D):
+            a = R[i, d]
+            b = T[i, d]
+            dot += a * b
+            nr += a * a
+            nt += b * b
+        rt_cs[i] = dot / max(np.sqrt(nr * nt), EPS)
+        rt_ed[i] = np.sqrt(max(nr + nt - np.float32(2.0) * dot, np.float32(0.0))) # ||r - t||^2 = ||r||^2 + ||t||^2 - 2 r.t
+    return rt_cs, rt_ed
+
+def _calc_self_ranks(I, M, block_size=SIM_BLOCK_SIZE):
+    '''Ranks each doc's trained DocVec by cosine similarity to its inferred DocVec, one tile of the similarity matrix at a time
+    (a doc's rank is the number of other trained DocVecs at least as similar to its inferred vector as its own, so no sorting is needed)
+    INPUT: (N, D) normalized inferred DocVecs, (N, D) normalized trained DocVecs, tile size
+    OUTPUT: array of N self-ranks (0 = recognized as most similar to itself)
+    '''
+    n_docs = I.shape[0]
+    ranks = np.full(n_docs, -1, dtype=int) # each doc's own DocVec is counted once below
+    for i in range(0, n_docs, block_size):
+        I_block = I[i:i + block_size]
+        self_sims = np.diagonal(I_block @ M[i:i + block_size].T)[:, None]
+        for j in range(0, M.shape[0], block_size):
+            S_block = I_block @ M[j:j + block_size].T
+            ranks[i:i + block_size] += (S_block >= self_sims).sum(axis=1)
+    return ranks
+
+def _make_pair_stats_dict(stats_by_pair):
+    '''Unpacks true/false pair summary stats (from a groupby on 'is_pair') into the dict format used for model evaluation
+    INPUT: DataFrame of mean/max/min indexed by is_pair
+    OUTPUT: dict of avg/max/min stats for true & false pairs
+    '''
+    return {'avg_tru':stats_by_pair.loc[1, 'mean'], 'avg_false':stats_by_pair.loc[0, 'mean'],
+            'max_tru':stats_by_pair.loc[1, 'max'], 'max_false':stats_by_pair.loc[0, 'max'],
+            'min_tru':stats_by_pair.loc[1, 'min'], 'min_false':stats_by_pair.loc[0, 'min']}
+
 class Doc2VecModeler(object):
     '''
     Uses Gensim's Doc2Vec model to keep track of different model variations for comparison
     '''
     def __init__(self, model_name, train_corpus, training_corpus_name,
-                 vector_size=100, dm=1, min_count=2, epochs=100):
+                 vector_size=100, dm=1, min_count=2, epochs=100, n_infer_threads=None):
         self.model_name = model_name
         self.train_corpus = train_corpus
         self.n_training_docs = len(self.train_corpus)
@@ -25,7 +84,10 @@ class Doc2VecModeler(object):
         self.dm = dm
         self.min_count = min_count
         self.epochs = epochs
-        self.inferred_vecs = {'docs': [], 'vecs': []}
+        self.n_infer_threads = n_infer_threads if n_infer_threads is not None else os.cpu_count()
+        self.inferred_vecs = {'docs': [], 'vecs': np.empty((0, self.vector_size), dtype=np.float32)}
+        self._infer_cache = dict()
+        self._fig = None
 
     def fit_model(self, verbose=False):
         '''Builds and trains model according to specifications
@@ -42,6 +104,42 @@ class Doc2VecModeler(object):
         if verbose:
             print("Model training complete!")
         self.model = model
+        self._infer_cache = dict() # drop inferences cached from a previously fit model
+
+    def _doc_ids(self, doc):
+        '''Maps a tokenized doc to the vocab indices of its in-vocab tokens (the only tokens inference uses)
+        INPUT: list of tokens
+        OUTPUT: np.array of vocab indices (int32)
+        '''
+        vocab = self.model.wv.vocab
+        return np.fromiter((vocab[word].index for word in doc if word in vocab), dtype=np.int32)
+
+    def _infer_vec(self, doc):
+        '''Infers the DocVec of a single tokenized doc (zero vector if none of its tokens are in the model's vocab)
+        Inferences are memoized, so docs that show up in several pairings are only inferred once
+        INPUT: list of tokens
+        OUTPUT: inferred DocVec (np.array)
+        '''
+        key = tuple(doc)
+        vec = self._infer_cache.get(key)
+        if vec is None:
+            if self._doc_ids(doc).size == 0: # vocab ids are only resolved once per unique doc, on a cache miss
+                vec = np.zeros(self.vector_size, dtype=np.float32)
+            else:
+                vec = np.asarray(self.model.infer_vector(doc, epochs=self.epochs), dtype=np.float32)
+            self._infer_cache[key] = vec
+        return vec
+
+    def _infer_vecs(self, docs):
+        '''Infers DocVecs for many docs at once, spread across a thread pool (gensim releases the GIL while inferring)
+        INPUT: list of token lists
+        OUTPUT: (n_docs, vector_size) array of inferred DocVecs, in the same order as docs
+        '''
+        vecs = np.empty((len(docs), self.vector_size), dtype=np.float32)
+        with ThreadPoolExecutor(max_workers=self.n_infer_threads) as executor:
+            for idx, vec in enumerate(executor.map(self._infer_vec, docs)):
+                vecs[idx] = vec
+        return vecs
 
     def calc_self_recognition_ability(self):
         '''Calculates the trained model's ability to recognize training documents as being most similar to themselves (across the corpus)
@@ -50,94 +148,103 @@ class Doc2VecModeler(object):
         OUTPUT: count/rate of self-recognition (int/float), test passed (bool)
         '''
         model = self.model
-        ranks = []
-        second_ranks = []
-        for doc_id in range(self.n_training_docs):
-            doc = self.train_corpus[doc_id].words
-            inferred_vector = self.model.infer_vector(doc, epochs=self.epochs)
-            self.inferred_vecs['docs'].append(doc)
-            self.inferred_vecs['vecs'].append(inferred_vector)
-            sims = model.docvecs.most_similar([inferred_vector], topn=len(model.docvecs)) # Gives you all document tags and their cosine similarity
-            rank = [docid for docid, sim in sims].index(doc_id) # Gets its own self-ranking
-            ranks.append(rank)
-            second_ranks.append(sims[1])
-        rank_counter = collections.Counter(ranks) # Let's count how each document ranks with respect to the training corpus
+        docs = [self.train_corpus[doc_id].words for doc_id in range(self.n_training_docs)]
+        inferred_vecs = self._infer_vecs(docs)
+        self.inferred_vecs['docs'] = docs
+        self.inferred_vecs['vecs'] = inferred_vecs
+        model.docvecs.init_sims()
+        M = model.docvecs.vectors_docs_norm.astype(np.float32, copy=False)
+        I = inferred_vecs / np.maximum(np.linalg.norm(inferred_vecs, axis=1, keepdims=True), EPS)
+        self_ranks = _calc_self_ranks(I, M) # Gets each doc's own self-ranking
+        rank_counter = collections.Counter(self_ranks.tolist()) # Let's count how each document ranks with respect to the training corpus
         self.rank_counter = rank_counter # Results vary between runs due to random seeding and very small corpus
         self.n_self_recognized = self.rank_counter[0]
         self.self_recog_rate = self.n_self_recognized / self.n_training_docs
         self.greater_than_95 = self.self_recog_rate >= 0.95
 
-    def calculate_pair_sims_array(self, pairings_df, is_train=True):
+    def _get_trained_tags(self, pairings_df, for_refs=True):
+        '''Finds the tag each pairing's lyric (or annotation) was trained under in this model's training corpus
+        The tagged ref-tate corpus is never looked up: every doc there also carries an int label tag (0/1),
+        so the DocVecs at those tags are shared label vectors, not the vectors of docs 0 and 1
+        INPUT: pairings DataFrame, whether to look up lyrics (True) or annotations (False)
+        OUTPUT: array of DocVec tags (-1 where the doc isn't in this model's training corpus)
+        '''
+        if self.training_corpus_name not in ('r_tr', 't_tr', 'rt_tr', 'rt_tagged_tr'):
+            raise ValueError("Unknown training corpus name '{}': can't look up trained DocVecs "
+                             "(use one of 'r_tr', 't_tr', 'rt_tr', 'rt_tagged_tr', or leave use_trained_vecs off)".format(self.training_corpus_name))
+        prefix = 'ref' if for_refs else 'tate'
+        doc_ids = pairings_df[prefix + '_doc_id'].to_numpy().astype(int)
+        in_train = pairings_df[prefix + '_in_train'].to_numpy().astype(bool)
+        if self.training_corpus_name == 'rt_tr':
+            offset = 0 if for_refs else self.n_training_docs // 2 # annotations follow the lyrics in the combined corpus
+        elif self.training_corpus_name == ('r_tr' if for_refs else 't_tr'):
+            offset = 0
+        else:
+            return np.full(len(doc_ids), -1)
+        return np.where(in_train, doc_ids + offset, -1)
+
+    def calculate_pair_sims_array(self, pairings_df, is_train=True, use_trained_vecs=False):
         '''Calculate array of the cosine similarities between inferred DocVecs of lyrics and annotations
+        With use_trained_vecs=True, docs the model was trained on use their trained DocVec instead (faster, but no longer an inferred-vs-inferred comparison)
         INPUT: lyric array, annotation array, trained Doc2Vec model
         OUTPUT: array of cosine similarities between inferred DocVecs
         '''
-        ref_vecs = []
-        tate_vecs = []
-        rt_cs = []
-        rt_ed = []
-        for row in pairings_df.index:
-            ref_doc = pairings_df.loc[row,['ref_pp_text']][0]
-            tate_doc = pairings_df.loc[row,['tate_pp_text']][0]
-            inf_ref_vec = self.model.infer_vector(ref_doc, epochs=self.epochs).reshape(-1, 1)
-            inf_tate_vec = self.model.infer_vector(tate_doc, epochs=self.epochs).reshape(-1, 1)
-            ref_vecs.append(inf_ref_vec)
-            tate_vecs.append(inf_tate_vec)
-            cs = 1 - cosine(inf_ref_vec, inf_tate_vec)
-            ed = euclidean(inf_ref_vec, inf_tate_vec)
-            rt_cs.append(cs)
-            rt_ed.append(ed)
+        ref_docs = pairings_df['ref_pp_text'].to_numpy()
+        tate_docs = pairings_df['tate_pp_text'].to_numpy()
+        n_pairs = len(ref_docs)
+        docs = list(ref_docs) + list(tate_docs)
+        if use_trained_vecs:
+            tags = np.concatenate([self._get_trained_tags(pairings_df, for_refs=True),
+                                   self._get_trained_tags(pairings_df, for_refs=False)])
+        else:
+            tags = np.full(len(docs), -1)
+        trained_vecs = self.model.docvecs.vectors_docs
+        is_trained = (tags >= 0) & (tags < len(trained_vecs))
+        vecs = np.empty((len(docs), self.vector_size), dtype=np.float32)
+        vecs[is_trained] = trained_vecs[tags[is_trained]]
+        vecs[~is_trained] = self._infer_vecs([docs[idx] for idx in np.flatnonzero(~is_trained)])
+        R, T = vecs[:n_pairs], vecs[n_pairs:]
+        rt_cs, rt_ed = pair_stats(R, T)
         calc_pairings_df = pairings_df.copy()
-        calc_pairings_df['ref_vecs'] = ref_vecs
-        calc_pairings_df['tate_vecs'] = tate_vecs
         calc_pairings_df['pair_cs'] = rt_cs
         calc_pairings_df['pair_ed'] = rt_ed
-        is_true_pair = calc_pairings_df['is_pair'] == 1
-        avg_true_pair_cs = calc_pairings_df[is_true_pair]['pair_cs'].mean()
-        avg_false_pair_cs = calc_pairings_df[~is_true_pair]['pair_cs'].mean()
-        max_true_pair_cs = calc_pairings_df[is_true_pair]['pair_cs'].max()
-        max_false_pair_cs = calc_pairings_df[~is_true_pair]['pair_cs'].max()
-        min_true_pair_cs = calc_pairings_df[is_true_pair]['pair_cs'].min()
-        min_false_pair_cs = calc_pairings_df[~is_true_pair]['pair_cs'].min()
-        pair_cs_stats = {'avg_tru':avg_true_pair_cs, 'avg_false':avg_false_pair_cs,
-                        'max_tru':max_true_pair_cs, 'max_false':max_false_pair_cs,
-                        'min_tru':min_true_pair_cs, 'min_false':min_false_pair_cs}
-        avg_true_pair_ed = calc_pairings_df[is_true_pair]['pair_ed'].mean()
-        avg_false_pair_ed = calc_pairings_df[~is_true_pair]['pair_ed'].mean()
-        max_true_pair_ed = calc_pairings_df[is_true_pair]['pair_ed'].max()
-        max_false_pair_ed = calc_pairings_df[~is_true_pair]['pair_ed'].max()
-        min_true_pair_ed = calc_pairings_df[is_true_pair]['pair_ed'].min()
-        min_false_pair_ed = calc_pairings_df[~is_true_pair]['pair_ed'].min()
-        pair_ed_stats = {'avg_tru':avg_true_pair_ed, 'avg_false':avg_false_pair_ed,
-                        'max_tru':max_true_pair_ed, 'max_false':max_false_pair_ed,
-                        'min_tru':min_true_pair_ed, 'min_false':min_false_pair_ed}
+        is_true_pair = (calc_pairings_df['is_pair'] == 1).to_numpy()
+        stats_by_pair = calc_pairings_df.groupby('is_pair')[['pair_cs', 'pair_ed']].agg(['mean', 'max', 'min'])
+        pair_cs_stats = _make_pair_stats_dict(stats_by_pair['pair_cs'])
+        pair_ed_stats = _make_pair_stats_dict(stats_by_pair['pair_ed'])
         if is_train:
             self.tr_pairings_df = calc_pairings_df.copy()
-            self.train_true_cs = calc_pairings_df[calc_pairings_df['is_pair'] == 1]['pair_cs']
-            self.train_false_cs = calc_pairings_df[calc_pairings_df['is_pair'] == 0]['pair_cs']
-            self.train_true_ed = calc_pairings_df[calc_pairings_df['is_pair'] == 1]['pair_ed']
-            self.train_false_ed = calc_pairings_df[calc_pairings_df['is_pair'] == 0]['pair_ed']
+            self.tr_ref_vecs_mat = R
+            self.tr_tate_vecs_mat = T
+            self.train_true_cs = rt_cs[is_true_pair]
+            self.train_false_cs = rt_cs[~is_true_pair]
+            self.train_true_ed = rt_ed[is_true_pair]
+            self.train_false_ed = rt_ed[~is_true_pair]
             self.tr_cs_pairings_stats = pair_cs_stats
             self.tr_ed_pairings_stats = pair_ed_stats
         else:
             self.tst_pairings_df = calc_pairings_df.copy()
-            self.test_true_cs = calc_pairings_df[calc_pairings_df['is_pair'] == 1]['pair_cs']
-            self.test_false_cs = calc_pairings_df[calc_pairings_df['is_pair'] == 0]['pair_cs']
-            self.test_true_ed = calc_pairings_df[calc_pairings_df['is_pair'] == 1]['pair_ed']
-            self.test_false_ed = calc_pairings_df[calc_pairings_df['is_pair'] == 0]['pair_ed']
+            self.tst_ref_vecs_mat = R
+            self.tst_tate_vecs_mat = T
+            self.test_true_cs = rt_cs[is_true_pair]
+            self.test_false_cs = rt_cs[~is_true_pair]
+            self.test_true_ed = rt_ed[is_true_pair]
+            self.test_false_ed = rt_ed[~is_true_pair]
             self.tst_cs_pairings_stats = pair_cs_stats
             self.tst_ed_pairings_stats = pair_ed_stats
 
     def calc_tt_hypothesis_test(self, for_train_pairings=True, for_cs=True):
-        '''Conducts two-tailed hypothesis test to determine whether true/false pair groups are statistically distinct from each other (at the 1% level)
+        '''Conducts two-tailed Welch's t-test to determine whether true/false pair groups are statistically distinct from each other (at the 1% level)
         INPUT: array of cosine similarities between true & false pairs
         OUTPUT: t-statistic (float), p value (float), whether test is significant (bool)
         '''
-        pairs_df = self.tr_pairings_df if for_train_pairings else self.tst_pairings_df
-        sim_col = 'pair_cs' if for_cs else 'pair_ed'
-        true_sims = pairs_df[pairs_df['is_pair'] == 1][sim_col]
-        false_sims = pairs_df[pairs_df['is_pair'] == 0][sim_col]
-        stat, p = ttest_ind(true_sims, false_sims)
+        if for_train_pairings:
+            true_sims = self.train_true_cs if for_cs else self.train_true_ed
+            false_sims = self.train_false_cs if for_cs else self.train_false_ed
+        else:
+            true_sims = self.test_true_cs if for_cs else self.test_true_ed
+            false_sims = self.test_false_cs if for_cs else self.test_false_ed
+        stat, p = ttest_ind(true_sims, false_sims, equal_var=False)
         if for_train_pairings:
             if for_cs:
                 self.cs_train_stat = stat
@@ -157,7 +264,7 @@ class Doc2VecModeler(object):
                 self.ed_test_p_val = p
                 self.ed_is_test_significant = p < 0.01
 
-    def plot_sim_distribution(self, use_train=True, use_cs=True, save_fig=False):
+    def plot_sim_distribution(self, use_train=True, use_cs=True, save_fig=False, show=False):
         '''Plot distributions of true/false cosine similarities of pairs (red = false, blue = true)
         INPUT: array of cosine similarities between true & false pairs
         OUTPUT: plot of distributions
@@ -168,47 +275,112 @@ class Doc2VecModeler(object):
         else:
             tru_pairs = self.test_true_cs if use_cs else self.test_true_ed
             non_pairs = self.test_false_cs if use_cs else self.test_false_ed
-        fig = plt.figure(figsize=(10,5))
+        if show: # pyplot stops tracking a figure once its window is closed, so shown plots get a fresh one
+            fig = plt.figure(figsize=(10,5))
+        else: # save-only plots reuse one figure across all of this model's plots
+            if self._fig is None:
+                self._fig = plt.figure(figsize=(10,5))
+            fig = self._fig
+            fig.clear()
         ax = fig.add_subplot(111)
         title = "Distributions of DocVec Similarity - Model:" + self.model_name
         ax.set_title(title, fontsize=18)
-        plt.hist(non_pairs, bins=100, color='red', alpha=0.3, label='mismatched pairs')
-        plt.hist(tru_pairs, bins=100, color='blue', alpha=0.3, label='true pairs')
-        plt.axvline(x=tru_pairs.mean(), c='blue', alpha=0.6, linewidth=3)
-        plt.axvline(x=non_pairs.mean(), c='red', alpha=0.6, linewidth=3)
+        non_counts, non_edges = np.histogram(non_pairs, bins=100)
+        tru_counts, tru_edges = np.histogram(tru_pairs, bins=100)
+        ax.bar(non_edges[:-1], non_counts, width=np.diff(non_edges), align='edge', color='red', alpha=0.3, label='mismatched pairs')
+        ax.bar(tru_edges[:-1], tru_counts, width=np.diff(tru_edges), align='edge', color='blue', alpha=0.3, label='true pairs')
+        ax.axvline(x=tru_pairs.mean(), c='blue', alpha=0.6, linewidth=3)
+        ax.axvline(x=non_pairs.mean(), c='red', alpha=0.6, linewidth=3)
         dist = "Cosine Similarity" if use_cs else "Euclidean Distance"
         x_label = dist + ' of Annotation & Lyric DocVectors'
         ax.set_xlabel(x_label, fontsize=16)
         ax.set_ylabel('Frequency', fontsize=16)
         ax.legend(loc='upper center', ncol=2, markerscale=0.5, bbox_to_anchor=(0.5, -0.15))
-        plt.show()
+        if show:
+            plt.show()
         if save_fig:
             shorthand_dist = 'cs' if use_cs else 'ed'
             fig.savefig('../images/{0}_dist_{1}.png'.format(shorthand_dist, self.model_name))
 
+def _set_pairings(train_pairings_df, test_pairings_df):
+    '''Stores the pairings DataFrames for train_one (also used as the worker initializer so they're only sent once per process)'''
+    _pairings['train'] = train_pairings_df
+    _pairings['test'] = test_pairings_df
+
+def _init_worker(train_pairings_df, test_pairings_df, corpora, n_threads):
+    '''Sets up a model-training worker process, capping its inference & Numba threads so parallel models share the cores'''
+    plt.switch_backend('Agg') # spawned workers don't inherit the parent's backend; plots are only saved
+    _set_pairings(train_pairings_df, test_pairings_df)
+    _corpora.update(corpora)
+    _worker_settings['n_threads'] = n_threads
+    set_num_threads(n_threads)
+
+def train_one(spec):
+    '''Trains and evaluates a single model variation
+    INPUT: (model_name, train_corpus, train_corp_name, vector_size) tuple
+    OUTPUT: trained & evaluated Doc2VecModeler
+    '''
+    model_name, train_corpus, train_corp_name, vector_size = spec
+    model = Doc2VecModeler(model_name, train_corpus, train_corp_name, vector_size=vector_size,
+                           n_infer_threads=_worker_settings['n_threads'])
+    model.fit_model(verbose=True)
+    model.calc_self_recognition_ability()
+    model.calculate_pair_sims_array(_pairings['train'], is_train=True)
+    model.calculate_pair_sims_array(_pairings['test'], is_train=False)
+    model.calc_tt_hypothesis_test(for_train_pairings=True, for_cs=True)
+    model.calc_tt_hypothesis_test(for_train_pairings=False, for_cs=True)
+    model.calc_tt_hypothesis_test(for_train_pairings=True, for_cs=False)
+    model.calc_tt_hypothesis_test(for_train_pairings=False, for_cs=False)
+    model.plot_sim_distribution(use_train=True, use_cs=True, save_fig=True)
+    model.plot_sim_distribution(use_train=False, use_cs=True, save_fig=True)
+    model.plot_sim_distribution(use_train=True, use_cs=False, save_fig=True)
+    model.plot_sim_distribution(use_train=False, use_cs=False, save_fig=True)
+    plt.close(model._fig) # don't ship the figure or inference scratch back from a worker process
+    model._fig = None
+    model._infer_cache = dict()
+    return model
+
+def _train_in_worker(spec):
+    '''Trains and evaluates a single model variation in a worker process, then drops what the parent already has
+    (corpus, pairings text) so only the model & its results are pickled back
+    INPUT: (model_name, train_corp_name, vector_size) tuple (the corpus is looked up by name)
+    OUTPUT: trained & evaluated Doc2VecModeler
+    '''
+    model_name, train_corp_name, vector_size = spec
+    model = train_one((model_name, _corpora[train_corp_name], train_corp_name, vector_size))
+    model.train_corpus = None
+    model.inferred_vecs['docs'] = []
+    result_cols = ['is_pair', 'pair_cs', 'pair_ed'] # index-aligned with the parent's pairings DataFrames
+    model.tr_pairings_df = model.tr_pairings_df[result_cols]
+    model.tst_pairings_df = model.tst_pairings_df[result_cols]
+    return model
+
 class DocVecModelEvaluator(object):
     '''
     Uses Gensim's Doc2Vec model to keep track of different model variations for comparison
     '''
     def __init__(self):
-        self.eval_areas_dict = {'model':0, 'self_recog_rate':0,'cs_train_p_val':0, 'cs_test_p_val':0, 'ed_train_p_val':0, 'ed_test_p_val':0, 'cs_is_train_significant':0, 'cs_is_test_significant':0, 'ed_is_train_significant':0, 'ed_is_test_significant':0, 'tr_cs_pairings_stats': 0, 'tst_cs_pairings_stats':0, 'tr_ed_pairings_stats':0, 'tst_ed_pairings_stats':0}
-        self.eval_dict = dict()
-
-    def train_new_model(self, model_name, train_corpus, train_corp_name, vector_size):
-        model = Doc2VecModeler(model_name, train_corpus, train_corp_name, vector_size=vector_size)
-        model.fit_model(verbose=True)
-        model.calc_self_recognition_ability()
-        model.calculate_pair_sims_array(train_pairings_df, is_train=True)
-        model.calculate_pair_sims_array(test_pairings_df, is_train=False)
-        model.calc_tt_hypothesis_test(for_train_pairings=True, for_cs=True)
-        model.calc_tt_hypothesis_test(for_train_pairings=False, for_cs=True)
-        model.calc_tt_hypothesis_test(for_train_pairings=True, for_cs=False)
-        model.calc_tt_hypothesis_test(for_train_pairings=False, for_cs=False)
-        model.plot_sim_distribution(use_train=True, use_cs=True, save_fig=True)
-        model.plot_sim_distribution(use_train=False, use_cs=True, save_fig=True)
-        model.plot_sim_distribution(use_train=True, use_cs=False, save_fig=True)
-        model.plot_sim_distribution(use_train=False, use_cs=False, save_fig=True)
-        update_stats(model)
+        self.eval_areas_dict = {'model':0, 'self_recog_rate':0,'cs_train_p_val':0, 'cs_test_p_val':0, 'ed_train_p_val':0, 'ed_test_p_val':0, 'cs_is_train_significant':0, 'cs_is_test_significant':0, 'ed_is_train_significant':0, 'ed_is_test_significant':0, 'tr_cs_pairings_stats': 0, 'tst_cs_pairings_stats':0, 'tr_ed_pairings_stats':0, 'tst_ed_pairings_stats':0, 'tr_cs_true_mean':0, 'tr_cs_false_mean':0, 'tst_cs_true_mean':0, 'tst_cs_false_mean':0, 'tr_ed_true_mean':0, 'tr_ed_false_mean':0, 'tst_ed_true_mean':0, 'tst_ed_false_mean':0}
+        self._cols = {k: [] for k in self.eval_areas_dict} # eval stats stored column-wise, one entry per model
+        self._names = []
+
+    def train_new_model(self, model_name, train_corpus, train_corp_name, vector_size, train_pairings_df, test_pairings_df):
+        _set_pairings(train_pairings_df, test_pairings_df)
+        model = train_one((model_name, train_corpus, train_corp_name, vector_size))
+        self.update_stats(model)
+
+    def train_new_models(self, specs, corpora, train_pairings_df, test_pairings_df):
+        '''Trains & evaluates several model variations in parallel, one model per process
+        Returned models keep their results but not their training corpus or the pairings text (see _train_in_worker)
+        INPUT: list of (model_name, train_corp_name, vector_size) specs, dict of training corpora by name, train/test pairings DataFrames
+        OUTPUT: None (stats for each model are recorded in spec order)
+        '''
+        max_workers = max(1, min(len(specs), os.cpu_count() // THREADS_PER_MODEL))
+        n_threads = max(1, os.cpu_count() // max_workers)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(train_pairings_df, test_pairings_df, corpora, n_threads)) as executor:
+            for model in executor.map(_train_in_worker, specs):
+                self.update_stats(model)
 
     def update_stats(self, model):
         model_eval_stats = self.eval_areas_dict.copy()
@@ -230,16 +402,18 @@ class DocVecModelEvaluator(object):
         model_eval_stats['tr_ed_false_mean'] = model.tr_ed_pairings_stats['avg_false']
         model_eval_stats['tst_ed_true_mean'] = model.tst_ed_pairings_stats['avg_tru']
         model_eval_stats['tst_ed_false_mean'] = model.tst_ed_pairings_stats['avg_false']
-        self.eval_dict[model.model_name] = model_eval_stats
-        self.eval_cols = self.eval_dict[model.model_name].keys()
+        self._names.append(model.model_name)
+        for k, v in model_eval_stats.items():
+            self._cols[k].append(v)
 
     def print_model_eval_stats(self):
-        eval_df = pd.DataFrame.from_dict(self.eval_dict, orient='index', columns=self.eval_cols)
+        eval_df = pd.DataFrame(self._cols, index=self._names)
         print(eval_df)
         self.eval_df = eval_df
         return eval_df
 
 def main():
+    plt.switch_backend('Agg') # batch sweep: plots are only saved, never shown
     corpus_dict = read_in_pkl('corpus_dict')
     train_df = read_in_pkl('train_df')
     test_df = read_in_pkl('test_df')
@@ -276,21 +450,21 @@ def main():
 
     doc_eval = DocVecModelEvaluator()
 
-    doc_eval.train_new_model('r_50', ref_train_pcorpus, 'r_tr', vector_size=50)
-    doc_eval.train_new_model('r_100', ref_train_pcorpus, 'r_tr', vector_size=100)
-    doc_eval.train_new_model('r_200', ref_train_pcorpus, 'r_tr', vector_size=200)
-
-    doc_eval.train_new_model('t_50', tate_train_pcorpus, 't_tr', vector_size=50)
-    doc_eval.train_new_model('t_100', tate_train_pcorpus, 't_tr', vector_size=100)
-    doc_eval.train_new_model('t_200', tate_train_pcorpus, 't_tr', vector_size=200)
-
-    doc_eval.train_new_model('rt_50', rt_train_pcorpus, 'rt_tr', vector_size=50)
-    doc_eval.train_new_model('rt_100', rt_train_pcorpus, 'rt_tr', vector_size=100)
-    doc_eval.train_new_model('rt_200', rt_train_pcorpus, 'rt_tr', vector_size=200)
-
-    doc_eval.train_new_model('rt_tagged_50', rt_tagged_train_pcorpus, 'rt_tagged_tr', vector_size=50)
-    doc_eval.train_new_model('rt_tagged_100', rt_tagged_train_pcorpus, 'rt_tagged_tr', vector_size=100)
-    doc_eval.train_new_model('rt_tagged_200', rt_tagged_train_pcorpus, 'rt_tagged_tr', vector_size=200)
+    corpora = {'r_tr': ref_train_pcorpus, 't_tr': tate_train_pcorpus,
+               'rt_tr': rt_train_pcorpus, 'rt_tagged_tr': rt_tagged_train_pcorpus}
+    specs = [('r_50', 'r_tr', 50),
+             ('r_100', 'r_tr', 100),
+             ('r_200', 'r_tr', 200),
+             ('t_50', 't_tr', 50),
+             ('t_100', 't_tr', 100),
+             ('t_200', 't_tr', 200),
+             ('rt_50', 'rt_tr', 50),
+             ('rt_100', 'rt_tr', 100),
+             ('rt_200', 'rt_tr', 200),
+             ('rt_tagged_50', 'rt_tagged_tr', 50),
+             ('rt_tagged_100', 'rt_tagged_tr', 100),
+             ('rt_tagged_200', 'rt_tagged_tr', 200)]
+    doc_eval.train_new_models(specs, corpora, train_pairings_df, test_pairings_df)
 
     eval_df = doc_eval.print_model_eval_stats()
 